@@ -0,0 +1,152 @@
+import asyncio
+import hashlib
+import json
+import textwrap
+
+from cachetools import TTLCache
+
+# The semantic tier needs an embedding model and a vector index; both are
+# optional extras, and the cache degrades to exact-match-only without them.
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    faiss = None
+    SentenceTransformer = None
+
+
+def make_key(model: str, language: str, role: str, code: str) -> str:
+    """Deterministic cache key for one agent call on one code submission."""
+    payload = json.dumps(
+        {"m": model, "l": language, "r": role, "c": code}, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMCache:
+    """Exact-match in-memory cache for LLM response strings.
+
+    Backed by a TTLCache so repeated submissions of the same code skip the
+    network round trip entirely; an asyncio.Lock keeps it safe when several
+    agent calls hit the cache concurrently.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = asyncio.Lock()
+
+    async def get(self, key: str) -> str | None:
+        async with self._lock:
+            return self._cache.get(key)
+
+    async def set(self, key: str, value: str) -> None:
+        async with self._lock:
+            self._cache[key] = value
+
+
+# Single-flight map: concurrent identical calls (same cache key) collapse
+# into one upstream request, with the late arrivals awaiting the first
+# caller's future instead of issuing duplicates.
+_inflight: dict[str, asyncio.Future] = {}
+
+
+def inflight(key: str) -> asyncio.Future | None:
+    """Return the future of an identical call already in flight, if any."""
+    return _inflight.get(key)
+
+
+async def get_or_run(key: str, coro_factory):
+    """Run coro_factory for this key, or await the call already running.
+
+    The first caller registers the work; every caller that arrives before
+    it finishes awaits the same task, so N identical concurrent requests
+    cost one upstream call. The factory runs in its own task and callers
+    await it through asyncio.shield, so a caller that disconnects (and
+    gets cancelled) neither aborts the generation nor poisons the result
+    for coalesced waiters; an abandoned run still completes and populates
+    the caches.
+    """
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(coro_factory())
+        _inflight[key] = task
+
+        def _done(t: asyncio.Future, _key: str = key) -> None:
+            _inflight.pop(_key, None)
+            if not t.cancelled():
+                t.exception()  # retrieved here so abandoned failures don't warn
+
+        task.add_done_callback(_done)
+    return await asyncio.shield(task)
+
+
+def normalize_code(code: str) -> str:
+    """Strip the formatting noise that shouldn't change the LLM's answer."""
+    return textwrap.dedent(code).strip()
+
+
+class SemanticCache:
+    """Second cache tier that also hits on near-duplicate submissions.
+
+    Normalized code is embedded with a small local model and stored in a
+    FAISS inner-product index; a lookup serves the stored response when
+    cosine similarity beats the threshold. One index is kept per
+    (language, role) pair, so a Python analysis can never be served for a
+    Rust query, and the three agents' identical embeddings for one code
+    submission never compete as nearest-neighbor ties. Each index is
+    bounded by max_entries and cleared when full so a long-lived worker
+    doesn't grow without limit. Disabled (every lookup misses) when
+    sentence-transformers or faiss is not installed.
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", threshold: float = 0.95,
+                 max_entries: int = 1024):
+        self.enabled = faiss is not None and SentenceTransformer is not None
+        self.threshold = threshold
+        self.max_entries = max_entries
+        if not self.enabled:
+            return
+        self._embedder = SentenceTransformer(model_name)
+        self._dim = self._embedder.get_sentence_embedding_dimension()
+        # (language, role) -> (FAISS index, values parallel to the index)
+        self._shards: dict[tuple[str, str], tuple["faiss.IndexFlatIP", list[str]]] = {}
+        self._lock = asyncio.Lock()
+
+    def _embed(self, code: str):
+        # Normalized embeddings make inner product equal cosine similarity
+        return self._embedder.encode([normalize_code(code)], normalize_embeddings=True)
+
+    async def get(self, language: str, role: str, code: str) -> str | None:
+        if not self.enabled:
+            return None
+        shard = self._shards.get((language, role))
+        if shard is None:
+            return None
+        vec = await asyncio.to_thread(self._embed, code)
+        async with self._lock:
+            index, values = shard
+            if index.ntotal == 0:
+                return None
+            scores, ids = index.search(vec, 1)
+            if ids[0][0] != -1 and scores[0][0] > self.threshold:
+                return values[ids[0][0]]
+        return None
+
+    async def set(self, language: str, role: str, code: str, value: str) -> None:
+        if not self.enabled:
+            return
+        vec = await asyncio.to_thread(self._embed, code)
+        async with self._lock:
+            shard = self._shards.get((language, role))
+            if shard is None:
+                shard = (faiss.IndexFlatIP(self._dim), [])
+                self._shards[(language, role)] = shard
+            index, values = shard
+            if len(values) >= self.max_entries:
+                # A flat index has no cheap per-entry eviction; clearing the
+                # full shard keeps memory bounded at the cost of warming up
+                # again, which the exact-match tier cushions
+                index.reset()
+                values.clear()
+            index.add(vec)
+            values.append(value)
